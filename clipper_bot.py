@@ -1,16 +1,27 @@
 import os
 import re
+import base64
+import copy
+import functools
+import html
+import json
+import time
+import shutil
+import tempfile
+import weakref
 import asyncio
 import logging
 from pathlib import Path
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from typing import Optional, Dict, List
 from dotenv import load_dotenv
 
 import aiohttp
-import aiofiles
+from aiohttp import web
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
+    AIORateLimiter,
     Application,
     CommandHandler,
     MessageHandler,
@@ -19,25 +30,44 @@ from telegram.ext import (
     filters,
 )
 from telegram.constants import ParseMode
+from telegram.error import BadRequest, RetryAfter, TelegramError
 import yt_dlp
-from moviepy.editor import VideoFileClip
-from aiohttp import web  # add this line
+from cachetools import TTLCache
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+try:
+    import re2
+except ImportError:
+    re2 = re
 
 # --- Health server for Render ---
 async def health(request):
     return web.Response(text="ok")
 
-async def start_health_server():
-    port = int(os.environ.get("PORT", os.environ.get("HTTP_PORT", 8080)))
+
+_health_runner = None
+
+
+async def start_health_server(port: int):
+    global _health_runner
     app = web.Application()
     app.router.add_get("/healthz", health)
-    runner = web.AppRunner(app)
-    await runner.setup()
-    site = web.TCPSite(runner, '0.0.0.0', port)
+    _health_runner = web.AppRunner(app)
+    await _health_runner.setup()
+    site = web.TCPSite(_health_runner, '0.0.0.0', port)
     await site.start()
     # don't block: leave site running in background
 
-                                               
+
+async def stop_health_server():
+    global _health_runner
+    if _health_runner is not None:
+        await _health_runner.cleanup()
+        _health_runner = None
+
 
 load_dotenv()
 
@@ -54,52 +84,160 @@ MAX_CLIP_SECONDS = int(os.getenv('MAX_CLIP_SECONDS', '180'))
 MAX_CLIPS = int(os.getenv('MAX_CLIPS', '5'))
 HTTP_PORT = int(os.getenv('HTTP_PORT', '8080'))
 
-DOWNLOAD_DIR = Path('downloads')
-CLIPS_DIR = Path('clips')
-DOWNLOAD_DIR.mkdir(exist_ok=True)
-CLIPS_DIR.mkdir(exist_ok=True)
+# sources and clips are short-lived, so keep them on RAM-backed /dev/shm when it has room; every
+# file there counts against container memory (one job's source + clips, plus the source cache)
+SHM_MIN_FREE_BYTES = int(os.getenv('CLIPPER_SHM_MIN_MB', '2048')) * 1024 * 1024
+
+
+def pick_work_dir() -> Path:
+    if os.getenv('CLIPPER_WORK_DIR'):
+        return Path(os.getenv('CLIPPER_WORK_DIR'))
+    try:
+        if shutil.disk_usage('/dev/shm').free >= SHM_MIN_FREE_BYTES:
+            return Path('/dev/shm/clipper')
+    except OSError:
+        pass
+    return Path('.')
+
+
+WORK_DIR = pick_work_dir()
+ON_TMPFS = str(WORK_DIR).startswith('/dev/shm')
+DOWNLOAD_DIR = WORK_DIR / 'downloads'
+CLIPS_DIR = WORK_DIR / 'clips'
+DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
+CLIPS_DIR.mkdir(parents=True, exist_ok=True)
+logger.info(f"📁 Working directory: {WORK_DIR.resolve()}")
+# on tmpfs one oversized source could push the container over its memory limit, so cap single downloads
+SHM_MAX_FILE_BYTES = int(os.getenv('CLIPPER_SHM_MAX_FILE_MB', '1024')) * 1024 * 1024
 
-user_states: Dict[int, Dict] = {}
-processing_messages: Dict[int, int] = {}
+
+def fits_work_dir(info: dict) -> bool:
+    # the source and its clips have to fit in what's left of the tmpfs; unknown sizes are left to max_filesize
+    if not ON_TMPFS:
+        return True
+    size = info.get('filesize') or info.get('filesize_approx')
+    if not size:
+        return True
+    return size <= SHM_MAX_FILE_BYTES and size * 2 < shutil.disk_usage(WORK_DIR).free
+
+# clips are cut in parallel by ffmpeg subprocesses, so this bounds concurrent ffmpeg processes per job
+CLIP_CONCURRENCY = int(os.getenv('CLIP_CONCURRENCY', str(os.cpu_count() or 2)))
+# uploads share the bot's bandwidth, so cap them across all jobs rather than per job
+UPLOAD_CONCURRENCY = int(os.getenv('UPLOAD_CONCURRENCY', '4'))
+upload_slots = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+# yt-dlp calls are slow and network-bound; bound them so a burst of links queues instead of spawning threads
+YTDLP_POOL = ThreadPoolExecutor(max_workers=int(os.getenv('YTDLP_WORKERS', '4')), thread_name_prefix='ytdlp')
+
+@dataclass(slots=True)
+class UserState:
+    state: str = ''
+    url: str = ''
+    clip_duration: int = 0
+    num_clips: int = 0
+    custom_range: Optional[tuple] = None
+
+
+# abandoned flows never reach a del, so idle sessions expire instead of piling up; TTLCache counts
+# from insertion, so every state transition re-assigns the entry to make the TTL mean idle time
+user_states: Dict[int, UserState] = TTLCache(maxsize=10_000, ttl=1800)
+
+# download/clip jobs run in the background; cap how many run at once and allow one per user
+JOB_CONCURRENCY = int(os.getenv('JOB_CONCURRENCY', '2'))
+job_slots = asyncio.Semaphore(JOB_CONCURRENCY)
+active_jobs: set = set()
 bot_stats = {'clips_created': 0, 'videos_processed': 0, 'total_users': set()}
 
+# static message texts, shared by the command and button handlers
+HELP_TEXT = (
+    "📖 <b>How to Use Clipper Bot</b>\n\n"
+    "1️⃣ Send me a video link (YouTube, Instagram, Twitter, etc.)\n"
+    "2️⃣ Choose your clip length (5s, 10s, 20s, 30s, or Custom)\n"
+    "3️⃣ Select how many clips you want (1-5)\n"
+    "4️⃣ Wait for processing ⚡\n"
+    "5️⃣ Get your download links!\n\n"
+    "<b>Custom Format:</b>\n"
+    "• <code>00H08M10S:00H09M20S</code> (8m10s to 9m20s)\n"
+    "• <code>1:30-2:45</code> (1m30s to 2m45s)\n"
+    "• <code>90-150</code> (90s to 150s)\n\n"
+    "⚠️ <b>Note:</b> Text links or commands only!"
+)
+MENU_HELP_TEXT = (
+    "📖 <b>How to Use Clipper Bot</b>\n\n"
+    "1️⃣ Send me a video link\n"
+    "2️⃣ Choose clip length\n"
+    "3️⃣ Select number of clips\n"
+    "4️⃣ Get your downloads!\n\n"
+    "<b>Custom Format:</b>\n"
+    "• <code>00H08M10S:00H09M20S</code>\n"
+    "• <code>1:30-2:45</code>\n"
+    "• <code>90-150</code>"
+)
+CUSTOM_RANGE_PROMPT = (
+    "✏️ <b>Custom Range</b>\n\n"
+    "Enter in format:\n"
+    "• <code>00H08M10S:00H09M20S</code>\n"
+    "• <code>1:30-2:45</code>\n"
+    "• <code>90-150</code>"
+)
+
+# static keyboards never change, so build them once instead of per message
+UPI_LINK = "upi://pay?pn=MD%20SHAHNAWAJ&am=&mode=01&pa=md.3282-40@waaxis"
+START_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📖 How to Use", callback_data="help")],
+    [InlineKeyboardButton("💬 Send Feedback", callback_data="feedback")],
+    [InlineKeyboardButton("☕ Donate", callback_data="donate")],
+])
+DONATE_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("☕ Donate via UPI", url=UPI_LINK)]])
+CREATE_ANOTHER_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("🔄 Create Another", callback_data="help")]])
+DURATION_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("5s", callback_data="dur_5"), InlineKeyboardButton("10s", callback_data="dur_10")],
+    [InlineKeyboardButton("20s", callback_data="dur_20"), InlineKeyboardButton("30s", callback_data="dur_30")],
+    [InlineKeyboardButton("✏️ Custom", callback_data="dur_custom")],
+])
+CLIPS_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton(f"{i} Clip{'s' if i > 1 else ''}", callback_data=f"clips_{i}")]
+    for i in range(1, min(MAX_CLIPS, 5) + 1)
+])
+
 
 def format_timestamp(seconds: float) -> str:
-    hours = int(seconds // 3600)
-    minutes = int((seconds % 3600) // 60)
-    secs = int(seconds % 60)
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
     return f"{hours:02d}H{minutes:02d}M{secs:02d}S"
 
 
+# one pass covers 1H2M3S / 2M3S, 1:02:03 / 2:03 and bare seconds
+TIMESTAMP_RE = re.compile(
+    r'(?:(?P<h>\d+)[hH])?(?P<m>\d+)[mM](?P<s>\d+)[sS]'
+    r'|(?:(?P<ch>\d+):)?(?P<cm>\d+):(?P<cs>\d+)'
+    r'|(?P<secs>\d+)'
+)
+YOUTUBE_ID_RE = re.compile(r'(?:youtube\.com/(?:watch\?(?:\S*?&)?v=|shorts/|live/|embed/)|youtu\.be/)([\w-]{11})')
+# URL_RE runs on every inbound message, so use RE2's linear-time matcher when it's installed
+URL_RE = re2.compile(r'https?://(?:www\.)?[-a-zA-Z0-9@:%._\+~#=]{1,256}\.[a-zA-Z0-9()]{1,6}\b(?:[-a-zA-Z0-9()@:%_\+.~#?&/=]*)')
+
+
 def parse_timestamp(timestamp: str) -> Optional[int]:
-    patterns = [
-        r'(\d+)[hH](\d+)[mM](\d+)[sS]',
-        r'(\d+):(\d+):(\d+)',
-        r'(\d+)[mM](\d+)[sS]',
-        r'(\d+):(\d+)',
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, timestamp)
-        if match:
-            groups = match.groups()
-            if len(groups) == 3:
-                return int(groups[0]) * 3600 + int(groups[1]) * 60 + int(groups[2])
-            elif len(groups) == 2:
-                return int(groups[0]) * 60 + int(groups[1])
+    match = TIMESTAMP_RE.fullmatch(timestamp)
+    if not match:
+        return None
     
-    if timestamp.isdigit():
-        return int(timestamp)
+    if match['secs'] is not None:
+        return int(match['secs'])
     
-    return None
+    hours = match['h'] or match['ch'] or 0
+    minutes = match['m'] or match['cm']
+    seconds = match['s'] or match['cs']
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
 
 
+@functools.lru_cache(maxsize=1024)
 def parse_custom_range(text: str) -> Optional[tuple]:
     auto_corrected = text.replace(' ', '').replace('h', 'H').replace('m', 'M').replace('s', 'S')
     
     parts = auto_corrected.split(':')
     if len(parts) != 2:
-        parts = re.split(r'[-,]', auto_corrected)
+        parts = auto_corrected.replace(',', '-').split('-')
     
     if len(parts) == 2:
         start = parse_timestamp(parts[0])
@@ -110,93 +248,547 @@ def parse_custom_range(text: str) -> Optional[tuple]:
     return None
 
 
+_http_session: Optional[aiohttp.ClientSession] = None
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    # one pooled session for all outbound HTTP so uploads reuse keep-alive connections
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=32, limit_per_host=8, ttl_dns_cache=300,
+                keepalive_timeout=60, enable_cleanup_closed=True,
+            ),
+            # no total cap since big clips take a while to upload; stalled sockets still time out
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=60),
+        )
+    return _http_session
+
+
+async def close_http_session():
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+
+GOFILE_SERVER_TTL = 300
+_gofile_server = {'name': None, 'expires': 0.0}
+
+
+async def get_gofile_server() -> str:
+    # GoFile hands out the same upload server for minutes, so only ask for one when the cached pick expires
+    now = time.monotonic()
+    if _gofile_server['name'] and now < _gofile_server['expires']:
+        return _gofile_server['name']
+    
+    try:
+        async with get_http_session().get('https://api.gofile.io/servers') as resp:
+            result = await resp.json(loads=json_loads)
+        name = result['data']['servers'][0]['name']
+    except Exception as e:
+        logger.warning(f"GoFile server lookup failed, using store1: {e}")
+        return 'store1'
+    
+    _gofile_server.update(name=name, expires=now + GOFILE_SERVER_TTL)
+    return name
+
+
+def forget_gofile_server():
+    # a failed upload may mean the cached server went away; resolve a fresh one next time
+    _gofile_server.update(name=None, expires=0.0)
+
+
 async def upload_to_gofile(file_path: Path) -> Optional[str]:
     try:
-        async with aiohttp.ClientSession() as session:
-            server_url = 'https://store1.gofile.io/uploadFile'
-            
-            async with aiofiles.open(file_path, 'rb') as f:
-                file_data = await f.read()
-            
-            data = aiohttp.FormData()
-            data.add_field('file', file_data, filename=file_path.name)
-            if GOFILE_API_KEY:
-                data.add_field('token', GOFILE_API_KEY)
+        session = get_http_session()
+        server_url = f'https://{await get_gofile_server()}.gofile.io/uploadFile'
+        
+        # hand aiohttp the open file so the body is streamed in chunks instead of read into memory
+        async with upload_slots:
+            with open(file_path, 'rb') as f:
+                data = aiohttp.FormData()
+                data.add_field('file', f, filename=file_path.name, content_type='video/mp4')
+                if GOFILE_API_KEY:
+                    data.add_field('token', GOFILE_API_KEY)
             
-            async with session.post(server_url, data=data) as resp:
-                if resp.status == 200:
-                    result = await resp.json()
-                    if result.get('status') == 'ok':
-                        return result['data']['downloadPage']
+                async with session.post(server_url, data=data) as resp:
+                    if resp.status == 200:
+                        result = await resp.json(loads=json_loads)
+                        if result.get('status') == 'ok':
+                            return result['data']['downloadPage']
                         
         logger.error(f"GoFile upload failed for {file_path.name}")
+        forget_gofile_server()
         return None
     except Exception as e:
         logger.error(f"GoFile upload error: {e}")
+        forget_gofile_server()
         return None 
 
 
-async def download_video(url: str, user_id: int) -> Optional[tuple]:
+def load_cookies() -> Optional[str]:
+    # ---- Handle cookies (Render Secret -> cookies.txt) ----
+    if not os.getenv("COOKIES_B64"):
+        return None
     try:
-        output_path = DOWNLOAD_DIR / f"{user_id}_{datetime.now().timestamp()}"
+        with open("cookies.txt", "wb") as f:
+            f.write(base64.b64decode(os.getenv("COOKIES_B64")))
+        logger.info("✅ Cookies file loaded successfully.")
+        return "cookies.txt"
+    except Exception as e:
+        logger.error(f"Failed to decode or write cookies: {e}")
+        return None
+
+
+COOKIE_PATH = load_cookies()
+
+# ---- yt-dlp options shared by every download ----
+YDL_BASE_OPTS = {
+    "format": "best[ext=mp4]/best",
+    "quiet": True,
+    "no_warnings": True,
+    # fetch DASH/HLS fragments in parallel and large progressive files in ranged chunks
+    "concurrent_fragment_downloads": int(os.getenv("CLIP_FRAG_CONC", "8")),
+    "http_chunk_size": 10 * 1024 * 1024,
+    "retries": 3,
+    "fragment_retries": 3,
+    "socket_timeout": 30,
+    # DASH formats are video-only or audio-only, so "best" never picks them; HLS stays on because its
+    # combined mp4 streams are what "best[ext=mp4]" picks at 720p/1080p
+    "youtube_include_dash_manifest": False,
+}
+if COOKIE_PATH:
+    YDL_BASE_OPTS["cookiefile"] = COOKIE_PATH
+if ON_TMPFS:
+    YDL_BASE_OPTS["max_filesize"] = SHM_MAX_FILE_BYTES
+
+
+INFO_CACHE_TTL = int(os.getenv('INFO_CACHE_TTL', '600'))
+_info_cache: Dict[str, tuple] = {}
+_info_locks: 'weakref.WeakValueDictionary[str, asyncio.Lock]' = weakref.WeakValueDictionary()
 
-        # ---- Handle cookies (Render Secret -> cookies.txt) ----
-        import base64
-        COOKIE_PATH = None
-        if os.getenv("COOKIES_B64"):
+
+def _extract_info_sync(url: str) -> Optional[dict]:
+    with yt_dlp.YoutubeDL(YDL_BASE_OPTS) as ydl:
+        info = ydl.extract_info(url, download=False)
+        return info if isinstance(info, dict) else None
+
+
+def canonical_url(url: str) -> str:
+    # collapse youtu.be / shorts / tracking-param variants onto one URL per video id
+    match = YOUTUBE_ID_RE.search(url)
+    if match:
+        return f"https://www.youtube.com/watch?v={match.group(1)}"
+    return url
+
+
+async def get_video_info(url: str) -> Optional[dict]:
+    url = canonical_url(url)
+    
+    # concurrent requests for the same URL wait on one extraction instead of each running yt-dlp
+    lock = _info_locks.get(url)
+    if lock is None:
+        lock = _info_locks[url] = asyncio.Lock()
+    
+    async with lock:
+        now = time.monotonic()
+        cached = _info_cache.get(url)
+        if cached and now - cached[0] < INFO_CACHE_TTL:
+            return cached[1]
+        
+        try:
+            loop = asyncio.get_running_loop()
+            info = await loop.run_in_executor(YTDLP_POOL, _extract_info_sync, url)
+        except Exception as e:
+            logger.error(f"Info extraction error: {e}")
+            return None
+        
+        if info:
+            for key in [k for k, (ts, _) in _info_cache.items() if now - ts >= INFO_CACHE_TTL]:
+                del _info_cache[key]
+            _info_cache[url] = (now, info)
+        return info
+
+
+def _download_sync(info: dict, output_path: Path) -> Optional[Path]:
+    ydl_opts = {**YDL_BASE_OPTS, "outtmpl": str(output_path) + ".%(ext)s"}
+
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        # reuse the cached extraction instead of running the extractor again
+        result = ydl.process_ie_result(copy.deepcopy(info), download=True)
+        if not result:
+            return None
+
+        return Path(ydl.prepare_filename(result))
+
+
+# popular links get clipped by several users in a row, so keep recent sources around keyed by video id
+# lives next to DOWNLOAD_DIR so jobs can hard-link from it; kept smaller when that means RAM
+SOURCE_CACHE_DIR = WORK_DIR / 'cache'
+SOURCE_CACHE_DIR.mkdir(exist_ok=True)
+SOURCE_CACHE_TTL = int(os.getenv('SOURCE_CACHE_TTL', '1800'))
+SOURCE_CACHE_MAX_BYTES = int(os.getenv('SOURCE_CACHE_MB', '512' if ON_TMPFS else '2048')) * 1024 * 1024
+_download_locks: 'weakref.WeakValueDictionary[str, asyncio.Lock]' = weakref.WeakValueDictionary()
+CACHE_KEY_UNSAFE_RE = re.compile(r'[^\w-]')
+
+
+def source_cache_key(info: dict) -> Optional[str]:
+    if not info.get('id'):
+        return None
+    return CACHE_KEY_UNSAFE_RE.sub('_', f"{info.get('extractor_key') or ''}_{info['id']}")
+
+
+def find_cached_source(key: str) -> Optional[Path]:
+    cutoff = time.time() - SOURCE_CACHE_TTL
+    for path in SOURCE_CACHE_DIR.glob(f"{key}.*"):
+        # skip yt-dlp leftovers like .part files or unmerged .f137.mp4 formats
+        if path.stem == key and path.stat().st_mtime >= cutoff:
+            return path
+    return None
+
+
+def evict_source_cache(keep: Optional[Path] = None) -> int:
+    # drop expired entries, then the least recently used ones until the cache fits its budget
+    cutoff = time.time() - SOURCE_CACHE_TTL
+    entries = []
+    removed = 0
+    with os.scandir(SOURCE_CACHE_DIR) as it:
+        for entry in it:
             try:
-                with open("cookies.txt", "wb") as f:
-                    f.write(base64.b64decode(os.getenv("COOKIES_B64")))
-                COOKIE_PATH = "cookies.txt"
-                logger.info("✅ Cookies file loaded successfully.")
-            except Exception as e:
-                logger.error(f"Failed to decode or write cookies: {e}")
-
-        # ---- yt-dlp options ----
-        ydl_opts = {
-            "format": "best[ext=mp4]/best",
-            "outtmpl": str(output_path) + ".%(ext)s",
-            "quiet": True,
-            "no_warnings": True,
-        }
-
-        # add cookies if available
-        if COOKIE_PATH:
-            ydl_opts["cookiefile"] = COOKIE_PATH
-
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            if not info:
-                return None
+                st = entry.stat(follow_symlinks=False)
+                if st.st_mtime < cutoff and entry.path != str(keep):
+                    os.unlink(entry.path)
+                    removed += 1
+                else:
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+            except OSError:
+                pass
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= SOURCE_CACHE_MAX_BYTES:
+            break
+        if path == str(keep):
+            continue
+        try:
+            os.unlink(path)
+            total -= size
+            removed += 1
+        except OSError:
+            pass
+    return removed
 
-            filename = ydl.prepare_filename(info)
-            duration = info.get("duration", 0) if isinstance(info, dict) else 0
-            title = info.get("title", "video") if isinstance(info, dict) else "video"
 
-            return (Path(filename), duration, title)
+def claim_source(source: Path, work_dir: Path) -> Optional[Path]:
+    # give the job its own link (or copy) so eviction can't pull the file out from under a running job
+    job_source = work_dir / source.name
+    try:
+        # mtime doubles as last-used time for expiry and LRU eviction
+        os.utime(source)
+        try:
+            os.link(source, job_source)
+        except FileNotFoundError:
+            raise
+        except OSError:
+            shutil.copy2(source, job_source)
+    except FileNotFoundError:
+        # evicted between the lookup and the claim
+        return None
+    return job_source
+
+
+def claim_cached_source(key: str, work_dir: Path) -> Optional[Path]:
+    source = find_cached_source(key)
+    return claim_source(source, work_dir) if source else None
+
+
+async def download_video(info: dict, work_dir: Path) -> Optional[Path]:
+    try:
+        loop = asyncio.get_running_loop()
+        key = source_cache_key(info)
+        if not key:
+            # the download blocks for its whole duration, so keep it off the event loop
+            return await loop.run_in_executor(YTDLP_POOL, _download_sync, info, work_dir / "source")
+        
+        # users clipping the same video at once share one download
+        lock = _download_locks.get(key)
+        if lock is None:
+            lock = _download_locks[key] = asyncio.Lock()
+        
+        async with lock:
+            job_source = await asyncio.to_thread(claim_cached_source, key, work_dir)
+            if job_source:
+                logger.info(f"Reusing cached source {job_source.name}")
+                return job_source
+            source = await loop.run_in_executor(YTDLP_POOL, _download_sync, info, SOURCE_CACHE_DIR / key)
+            if not source:
+                return None
+            job_source = await asyncio.to_thread(claim_source, source, work_dir)
+            await asyncio.to_thread(evict_source_cache, source)
+        return job_source
 
     except Exception as e:
         logger.error(f"Download error: {e}")
         return None
 
-async def create_clip(video_path: Path, start: int, end: int, output_path: Path) -> bool:
+
+def _download_section_sync(info: dict, output_path: Path, start: int, end: int) -> Optional[Path]:
+    ydl_opts = {
+        **YDL_BASE_OPTS,
+        "outtmpl": str(output_path) + ".%(ext)s",
+        "download_ranges": yt_dlp.utils.download_range_func(None, [(start, end)]),
+        # the tmpfs size cap is about whole sources; a section is only the requested range
+        "max_filesize": None,
+    }
+
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        ydl.process_ie_result(copy.deepcopy(info), download=True)
+
+    # section downloads rename their output, so look for it instead of trusting prepare_filename
+    for path in output_path.parent.glob(f"{output_path.name}.*"):
+        if path.stem == output_path.name and path.stat().st_size > 0:
+            return path
+    return None
+
+
+async def download_section(info: dict, work_dir: Path, start: int, end: int) -> Optional[Path]:
+    # ffmpeg fetches only [start, end] from the stream, so a short range out of a long video skips the rest
     try:
-        clip = VideoFileClip(str(video_path))
-        subclip = clip.subclip(start, end)
-        subclip.write_videofile(
-            str(output_path),
-            codec='libx264',
-            audio_codec='aac',
-            temp_audiofile=str(output_path.parent / 'temp_audio.m4a'),
-            remove_temp=True,
-            logger=None
-        )
-        clip.close()
-        subclip.close()
-        return True
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(YTDLP_POOL, _download_section_sync, info, work_dir / "section", start, end)
     except Exception as e:
-        logger.error(f"Clip creation error: {e}")
+        logger.warning(f"Section download failed, falling back to full download: {e}")
+        return None
+
+
+async def run_subprocess(cmd: List[str], timeout: int = 600) -> tuple:
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise
+    return proc.returncode, stdout, stderr
+
+
+async def run_ffmpeg(cmd: List[str], output_path: Path, what: str) -> bool:
+    try:
+        returncode, _, stderr = await run_subprocess(cmd)
+    except (OSError, asyncio.TimeoutError) as e:
+        logger.warning(f"{what} failed for {output_path.name}: {e!r}")
+        return False
+    if returncode != 0 or not output_path.exists() or output_path.stat().st_size == 0:
+        logger.warning(f"{what} failed for {output_path.name}: {stderr.decode(errors='ignore')[-300:]}")
         return False
+    return True
+
+
+async def copy_clip(video_path: Path, start: int, end: int, output_path: Path) -> bool:
+    # -ss before -i seeks the demuxer straight to the nearest keyframe and -c copy skips re-encoding
+    cmd = [
+        'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+        '-ss', str(start), '-i', str(video_path), '-t', str(end - start),
+        '-c', 'copy', '-avoid_negative_ts', 'make_zero', '-movflags', '+faststart',
+        str(output_path),
+    ]
+    return await run_ffmpeg(cmd, output_path, "Stream copy")
+
+
+async def copy_clips(video_path: Path, ranges: List[tuple], output_paths: List[Path]) -> bool:
+    # one ffmpeg process for every range: each input still seeks on its own, but startup and probing happen once
+    cmd = ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error']
+    for start, end in ranges:
+        cmd += ['-ss', str(start), '-t', str(end - start), '-i', str(video_path)]
+    for i, output_path in enumerate(output_paths):
+        cmd += [
+            '-map', f'{i}:v:0?', '-map', f'{i}:a:0?',
+            '-c', 'copy', '-avoid_negative_ts', 'make_zero', '-movflags', '+faststart',
+            str(output_path),
+        ]
+    try:
+        returncode, _, stderr = await run_subprocess(cmd)
+    except (OSError, asyncio.TimeoutError) as e:
+        returncode, stderr = None, repr(e).encode()
+    if returncode != 0:
+        logger.warning(f"Batch stream copy failed: {stderr.decode(errors='ignore')[-300:]}")
+        # outputs of a failed run may be truncated; let the per-clip path redo them
+        for output_path in output_paths:
+            output_path.unlink(missing_ok=True)
+        return False
+    return True
+
+
+# auto probes once with a one-frame NVENC encode (distro ffmpeg builds list h264_nvenc even without a GPU);
+# cuda forces it, none always uses libx264
+CLIPPER_HWACCEL = os.getenv('CLIPPER_HWACCEL', 'auto').lower()
+_has_nvenc: Optional[bool] = None
+
+
+async def has_nvenc() -> bool:
+    global _has_nvenc
+    if _has_nvenc is None:
+        if CLIPPER_HWACCEL == 'none':
+            _has_nvenc = False
+        elif CLIPPER_HWACCEL == 'cuda':
+            _has_nvenc = True
+        else:
+            try:
+                returncode, _, _ = await run_subprocess([
+                    'ffmpeg', '-hide_banner', '-loglevel', 'error',
+                    '-f', 'lavfi', '-i', 'nullsrc', '-frames:v', '1', '-c:v', 'h264_nvenc', '-f', 'null', '-',
+                ], timeout=10)
+                _has_nvenc = returncode == 0
+            except (OSError, asyncio.TimeoutError):
+                _has_nvenc = False
+            logger.info(f"NVENC {'available' if _has_nvenc else 'not available'}")
+    return _has_nvenc
+
+
+async def reencode_clip(video_path: Path, start: int, end: int, output_path: Path) -> bool:
+    # fall back to a re-encode when the source can't be stream-copied into mp4 (odd codecs, keyframe gaps)
+    seek = ['-ss', str(start), '-i', str(video_path), '-t', str(end - start)]
+    tail = ['-c:a', 'aac', '-movflags', '+faststart', str(output_path)]
+    if await has_nvenc():
+        # decode and encode on the GPU so concurrent jobs don't fight over CPU cores
+        cmd = [
+            'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+            '-hwaccel', 'cuda', '-hwaccel_output_format', 'cuda', *seek,
+            '-c:v', 'h264_nvenc', '-preset', 'p4', '-tune', 'hq', '-b:v', '4M', *tail,
+        ]
+        if await run_ffmpeg(cmd, output_path, "NVENC re-encode"):
+            return True
+    cmd = [
+        'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error', *seek,
+        '-c:v', 'libx264', '-preset', 'ultrafast', *tail,
+    ]
+    return await run_ffmpeg(cmd, output_path, "Re-encode")
+
+
+async def create_clip(video_path: Path, start: int, end: int, output_path: Path) -> bool:
+    if await copy_clip(video_path, start, end, output_path):
+        return True
+    return await reencode_clip(video_path, start, end, output_path)
+
+
+STALE_FILE_SECONDS = 3600
+
+
+def clean_stale_files(max_age: int = STALE_FILE_SECONDS) -> int:
+    # scandir hands back cached type/stat info, so each entry costs one syscall instead of two
+    cutoff = time.time() - max_age
+    removed = 0
+    for directory in (DOWNLOAD_DIR, CLIPS_DIR):
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.stat(follow_symlinks=False).st_mtime >= cutoff:
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                    else:
+                        os.unlink(entry.path)
+                    removed += 1
+                except OSError:
+                    pass
+    return removed
+
+
+async def cleanup_job(context: ContextTypes.DEFAULT_TYPE):
+    removed = await asyncio.to_thread(clean_stale_files)
+    removed += await asyncio.to_thread(evict_source_cache)
+    if removed:
+        logger.info(f"🧹 Removed {removed} stale files")
+
+
+async def expire_sessions_job(context: ContextTypes.DEFAULT_TYPE):
+    # TTLCache only evicts on access, so sweep periodically to free idle users' entries
+    user_states.expire()
+
+
+STATUS_EDIT_INTERVAL = 1.0
+
+
+# the progress message a job keeps editing; Telegram allows roughly one edit per second per chat,
+# so edits inside that window are held back and only the newest is sent once it passes,
+# unchanged text is skipped and final edits always go out immediately
+class StatusMessage:
+    def __init__(self, bot, chat_id: int, message_id: int):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.last_text = None
+        self.last_sent = 0.0
+        self.pending = None
+        self.flush_task = None
+        self.lock = asyncio.Lock()
+
+    async def update(self, text: str, final: bool = False, **kwargs):
+        if text == self.last_text and not kwargs:
+            self.pending = None
+            return
+        wait = STATUS_EDIT_INTERVAL - (time.monotonic() - self.last_sent)
+        if not final and wait > 0:
+            self.pending = (text, kwargs)
+            if self.flush_task is None:
+                self.flush_task = asyncio.create_task(self._flush_later(wait))
+            return
+        
+        self.pending = None
+        await self._send(text, **kwargs)
+
+    async def _flush_later(self, delay: float):
+        await asyncio.sleep(delay)
+        self.flush_task = None
+        if self.pending is None:
+            return
+        text, kwargs = self.pending
+        self.pending = None
+        try:
+            await self._send(text, **kwargs)
+        except TelegramError as e:
+            logger.warning(f"Status edit failed: {e}")
+
+    async def _send(self, text: str, **kwargs):
+        # the lock keeps a delayed flush from landing after a newer edit
+        async with self.lock:
+            try:
+                await self._edit(text, **kwargs)
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+                await self._edit(text, **kwargs)
+            
+            self.last_text = text
+            self.last_sent = time.monotonic()
+
+    async def _edit(self, text: str, **kwargs):
+        await self.bot.edit_message_text(
+            chat_id=self.chat_id, message_id=self.message_id, text=text, parse_mode=ParseMode.HTML, **kwargs
+        )
+
+
+def delete_later(context, *messages, delay: float = 0):
+    # deleting is housekeeping; schedule it so the handler (and every update queued behind it) isn't held up
+    context.application.create_task(_delete_after(context.bot, messages, delay))
+
+
+async def _delete_after(bot, messages, delay: float):
+    if delay:
+        await asyncio.sleep(delay)
+    try:
+        if len(messages) == 1:
+            await messages[0].delete()
+        else:
+            # deleteMessages removes them all in a single API call
+            await bot.delete_messages(
+                chat_id=messages[0].chat_id,
+                message_ids=[m.message_id for m in messages]
+            )
+    except TelegramError:
+        pass
 
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -206,15 +798,8 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     bot_stats['total_users'].add(user.id)
     
-    keyboard = [
-        [InlineKeyboardButton("📖 How to Use", callback_data="help")],
-        [InlineKeyboardButton("💬 Send Feedback", callback_data="feedback")],
-        [InlineKeyboardButton("☕ Donate", callback_data="donate")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     welcome_text = (
-        f"👋 <b>Welcome {user.first_name}!</b>\n\n"
+        f"👋 <b>Welcome {html.escape(user.first_name)}!</b>\n\n"
         f"🎬 <b>Clipper Bot</b> - Your Video Clipping Assistant\n\n"
         f"✨ I can trim videos from YouTube, Instagram, Twitter, and more!\n\n"
         f"💡 Just send me a video link and I'll help you create perfect clips.\n\n"
@@ -223,35 +808,19 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     msg = await update.message.reply_text(
         welcome_text,
-        reply_markup=reply_markup,
+        reply_markup=START_MARKUP,
         parse_mode=ParseMode.HTML
     )
     
-    await asyncio.sleep(2)
-    await update.message.delete()
+    delete_later(context, update.message, delay=2)
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message:
         return
     
-    help_text = (
-        "📖 <b>How to Use Clipper Bot</b>\n\n"
-        "1️⃣ Send me a video link (YouTube, Instagram, Twitter, etc.)\n"
-        "2️⃣ Choose your clip length (5s, 10s, 20s, 30s, or Custom)\n"
-        "3️⃣ Select how many clips you want (1-5)\n"
-        "4️⃣ Wait for processing ⚡\n"
-        "5️⃣ Get your download links!\n\n"
-        "<b>Custom Format:</b>\n"
-        "• <code>00H08M10S:00H09M20S</code> (8m10s to 9m20s)\n"
-        "• <code>1:30-2:45</code> (1m30s to 2m45s)\n"
-        "• <code>90-150</code> (90s to 150s)\n\n"
-        "⚠️ <b>Note:</b> Text links or commands only!"
-    )
-    
-    msg = await update.message.reply_text(help_text, parse_mode=ParseMode.HTML)
-    await asyncio.sleep(2)
-    await update.message.delete()
+    msg = await update.message.reply_text(HELP_TEXT, parse_mode=ParseMode.HTML)
+    delete_later(context, update.message, delay=2)
 
 
 async def feedback_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -259,7 +828,7 @@ async def feedback_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     user_id = update.effective_user.id
-    user_states[user_id] = {'state': 'awaiting_feedback'}
+    user_states[user_id] = UserState(state='awaiting_feedback')
     
     msg = await update.message.reply_text(
         "💬 <b>Send Your Feedback</b>\n\n"
@@ -267,32 +836,25 @@ async def feedback_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode=ParseMode.HTML
     )
     
-    await asyncio.sleep(2)
-    await update.message.delete()
+    delete_later(context, update.message, delay=2)
 
 
 async def donate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not update.update.effective_user or not update.message:
+    if not update.effective_user or not update.message:
         return
  
     user_id = update.effective_user.id
-    user_states[user_id] = {'state': 'awaiting_donation'}
-    
-    upi_link = "upi://pay?pn=MD%20SHAHNAWAJ&am=&mode=01&pa=md.3282-40@waaxis"
-    
-    keyboard = [[InlineKeyboardButton("☕ Donate via UPI", url=upi_link)]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    user_states[user_id] = UserState(state='awaiting_donation')
     
     msg = await update.message.reply_text(
         "☕ <b>Support Clipper Bot</b>\n\n"
         "Your donations help keep this bot running!\n"
         "Thank you for your support! 🙏",
-        reply_markup=reply_markup,
+        reply_markup=DONATE_MARKUP,
         parse_mode=ParseMode.HTML
     )
     
-    await asyncio.sleep(2)
-    await update.message.delete()
+    delete_later(context, update.message, delay=2)
 
 
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -319,35 +881,33 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     text = update.message.text
     
-    if user_id in user_states and user_states[user_id].get('state') == 'awaiting_feedback':
+    if user_id in user_states and user_states[user_id].state == 'awaiting_feedback':
         await context.bot.send_message(
             chat_id=ADMIN_ID,
-            text=f"💬 <b>Feedback from {update.effective_user.first_name}</b>\n\n{text}",
+            text=f"💬 <b>Feedback from {html.escape(update.effective_user.first_name)}</b>\n\n{html.escape(text)}",
             parse_mode=ParseMode.HTML
         )
         await update.message.reply_text("✅ Thanks for your feedback!")
         del user_states[user_id]
-        await asyncio.sleep(3)
-        await update.message.delete()
+        delete_later(context, update.message, delay=3)
         return
     
-    if user_id in user_states and user_states[user_id].get('state') == 'awaiting_custom':
+    if user_id in user_states and user_states[user_id].state == 'awaiting_custom':
         custom_range = parse_custom_range(text)
         if custom_range:
             start, end = custom_range
-            user_states[user_id]['clip_duration'] = end - start
-            user_states[user_id]['custom_range'] = (start, end)
-            user_states[user_id]['state'] = 'choose_clips'
-            
-            max_possible = min(MAX_CLIPS, 5)
-            keyboard = [[InlineKeyboardButton(f"{i} Clip{'s' if i > 1 else ''}", callback_data=f"clips_{i}")] for i in range(1, max_possible + 1)]
+            state = user_states[user_id]
+            state.clip_duration = end - start
+            state.custom_range = (start, end)
+            state.state = 'choose_clips'
+            user_states[user_id] = state
             
             await update.message.reply_text(
                 f"✅ Custom range set: {format_timestamp(start)} - {format_timestamp(end)}\n\n"
                 f"How many clips do you want?",
-                reply_markup=InlineKeyboardMarkup(keyboard)
+                reply_markup=CLIPS_MARKUP
             )
-            await update.message.delete()
+            delete_later(context, update.message)
         else:
             await update.message.reply_text(
                 "❌ Invalid format! Try:\n"
@@ -356,46 +916,152 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "• <code>90-150</code>",
                 parse_mode=ParseMode.HTML
             )
-            await asyncio.sleep(5)
-            await update.message.delete()
+            delete_later(context, update.message, delay=5)
         return
     
-    url_pattern = r'https?://(?:www\.)?[-a-zA-Z0-9@:%._\+~#=]{1,256}\.[a-zA-Z0-9()]{1,6}\b(?:[-a-zA-Z0-9()@:%_\+.~#?&/=]*)'
-    urls = re.findall(url_pattern, text)
+    url_match = URL_RE.search(text)
     
-    if urls:
-        user_states[user_id] = {
-            'url': urls[0],
-            'state': 'choose_duration'
-        }
-        
-        keyboard = [
-            [InlineKeyboardButton("5s", callback_data="dur_5"), InlineKeyboardButton("10s", callback_data="dur_10")],
-            [InlineKeyboardButton("20s", callback_data="dur_20"), InlineKeyboardButton("30s", callback_data="dur_30")],
-            [InlineKeyboardButton("✏️ Custom", callback_data="dur_custom")]
-        ]
+    if url_match:
+        user_states[user_id] = UserState(state='choose_duration', url=url_match.group(0))
         
         msg = await update.message.reply_text(
             "🎬 <b>Video link received!</b>\n\n"
             "⏱️ Choose your clip length:",
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            reply_markup=DURATION_MARKUP,
             parse_mode=ParseMode.HTML
         )
         
-        await asyncio.sleep(2)
-        await update.message.delete()
+        delete_later(context, update.message, delay=2)
     else:
         msg = await update.message.reply_text(
             "⚠️ <b>Text links or commands only.</b>\n\n"
             "Please send a valid video URL or use /help for instructions.",
             parse_mode=ParseMode.HTML
         )
-        await asyncio.sleep(5)
-        try:
-            await update.message.delete()
-            await msg.delete()
-        except:
-            pass
+        delete_later(context, update.message, msg, delay=5)
+
+
+async def edit_menu(query, context, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None, **kwargs):
+    # double taps would re-send an identical menu, which Telegram rejects as "message is not modified"
+    signature = hash((
+        query.message.message_id if query.message else None,
+        text,
+        reply_markup.to_json() if reply_markup else None,
+    ))
+    if context.user_data.get('menu_sig') == signature:
+        return
+    
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup, **kwargs)
+    except BadRequest as e:
+        if 'not modified' not in str(e).lower():
+            raise
+    context.user_data['menu_sig'] = signature
+
+
+async def _cb_help(query, context, user_id: int, value: str):
+    await edit_menu(query, context, MENU_HELP_TEXT, parse_mode=ParseMode.HTML)
+
+
+async def _cb_feedback(query, context, user_id: int, value: str):
+    user_states[user_id] = UserState(state='awaiting_feedback')
+    await edit_menu(
+        query, context,
+        "💬 <b>Send Your Feedback</b>\n\n"
+        "Please type your message:",
+        parse_mode=ParseMode.HTML
+    )
+
+
+async def _cb_donate(query, context, user_id: int, value: str):
+    await edit_menu(
+        query, context,
+        "☕ <b>Support Clipper Bot</b>\n\n"
+        "Your donations help keep this bot running!\n"
+        "Thank you! 🙏",
+        reply_markup=DONATE_MARKUP,
+        parse_mode=ParseMode.HTML
+    )
+
+
+DURATION_CHOICES = {"5": 5, "10": 10, "20": 20, "30": 30}
+
+
+async def _cb_duration(query, context, user_id: int, value: str):
+    state = user_states[user_id]
+    if value == "custom":
+        state.state = 'awaiting_custom'
+        user_states[user_id] = state
+        await edit_menu(query, context, CUSTOM_RANGE_PROMPT, parse_mode=ParseMode.HTML)
+        return
+    
+    duration = DURATION_CHOICES.get(value, 10)
+    state.clip_duration = duration
+    state.state = 'choose_clips'
+    user_states[user_id] = state
+    
+    await edit_menu(
+        query, context,
+        f"⏱️ Clip length: <b>{duration}s</b>\n\n"
+        f"How many clips do you want?",
+        reply_markup=CLIPS_MARKUP,
+        parse_mode=ParseMode.HTML
+    )
+
+
+async def _cb_clips(query, context, user_id: int, value: str):
+    if user_id in active_jobs:
+        # keep the clip buttons so the user can pick again once the running job is done
+        await edit_menu(
+            query, context,
+            "⏳ Your previous video is still processing. Please wait for it to finish, then choose again.\n\n"
+            "How many clips do you want?",
+            reply_markup=CLIPS_MARKUP
+        )
+        return
+    
+    state = user_states.get(user_id)
+    if state is None:
+        await edit_menu(query, context, "❌ Session expired. Please send the video link again.")
+        return
+    state.num_clips = int(value)
+    user_states[user_id] = state
+    
+    await edit_menu(
+        query, context,
+        f"💥⚡💥 <b>Processing your request...</b>\n\n"
+        f"Please wait while I work on your video!",
+        parse_mode=ParseMode.HTML
+    )
+    # the job may sit in the queue past the session TTL, so it carries its own state and status message
+    if query.message:
+        message = (query.message.chat_id, query.message.message_id)
+    else:
+        message = (user_id, None)
+    
+    # hand the job off so the update handler returns and the bot keeps serving other users
+    active_jobs.add(user_id)
+    context.application.create_task(run_job(query, context, user_id, state, message))
+
+
+async def run_job(query, context, user_id: int, state: UserState, message: tuple):
+    try:
+        async with job_slots:
+            await process_video(query, context, user_id, state, message)
+    finally:
+        active_jobs.discard(user_id)
+
+
+CALLBACK_DEBOUNCE = 1.0
+
+# callback_data is "<prefix>" or "<prefix>_<value>"; the bool marks handlers that need an active session
+CALLBACK_HANDLERS = {
+    "help": (_cb_help, False),
+    "feedback": (_cb_feedback, False),
+    "donate": (_cb_donate, False),
+    "dur": (_cb_duration, True),
+    "clips": (_cb_clips, True),
+}
 
 
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -405,218 +1071,169 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await query.answer()
     
+    # a double tap delivers the same callback twice; only the first one does any work
+    now = time.monotonic()
+    last = context.user_data.get('last_callback')
+    context.user_data['last_callback'] = (query.data, now)
+    if last and last[0] == query.data and now - last[1] < CALLBACK_DEBOUNCE:
+        return
+    
     user_id = query.from_user.id
-    data = query.data
-    
-    if data == "help":
-        help_text = (
-            "📖 <b>How to Use Clipper Bot</b>\n\n"
-            "1️⃣ Send me a video link\n"
-            "2️⃣ Choose clip length\n"
-            "3️⃣ Select number of clips\n"
-            "4️⃣ Get your downloads!\n\n"
-            "<b>Custom Format:</b>\n"
-            "• <code>00H08M10S:00H09M20S</code>\n"
-            "• <code>1:30-2:45</code>\n"
-            "• <code>90-150</code>"
-        )
-        await query.edit_message_text(help_text, parse_mode=ParseMode.HTML)
-        
-    elif data == "feedback":
-        user_states[user_id] = {'state': 'awaiting_feedback'}
-        await query.edit_message_text(
-            "💬 <b>Send Your Feedback</b>\n\n"
-            "Please type your message:",
-            parse_mode=ParseMode.HTML
-        )
-        
-    elif data == "donate":
-        upi_link = "upi://pay?pn=MD%20SHAHNAWAJ&am=&mode=01&pa=md.3282-40@waaxis"
-        keyboard = [[InlineKeyboardButton("☕ Donate via UPI", url=upi_link)]]
-        await query.edit_message_text(
-            "☕ <b>Support Clipper Bot</b>\n\n"
-            "Your donations help keep this bot running!\n"
-            "Thank you! 🙏",
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode=ParseMode.HTML
-        )
-        
-    elif data.startswith("dur_"):
-        if user_id not in user_states:
-            await query.edit_message_text("❌ Session expired. Please send the video link again.")
-            return
-        
-        duration_map = {"dur_5": 5, "dur_10": 10, "dur_20": 20, "dur_30": 30}
-        
-        if data == "dur_custom":
-            user_states[user_id]['state'] = 'awaiting_custom'
-            await query.edit_message_text(
-                "✏️ <b>Custom Range</b>\n\n"
-                "Enter in format:\n"
-                "• <code>00H08M10S:00H09M20S</code>\n"
-                "• <code>1:30-2:45</code>\n"
-                "• <code>90-150</code>",
-                parse_mode=ParseMode.HTML
-            )
-        else:
-            duration = duration_map.get(data, 10)
-            user_states[user_id]['clip_duration'] = duration
-            user_states[user_id]['state'] = 'choose_clips'
-            
-            max_possible = min(MAX_CLIPS, 5)
-            keyboard = [[InlineKeyboardButton(f"{i} Clip{'s' if i > 1 else ''}", callback_data=f"clips_{i}")] for i in range(1, max_possible + 1)]
-            
-            await query.edit_message_text(
-                f"⏱️ Clip length: <b>{duration}s</b>\n\n"
-                f"How many clips do you want?",
-                reply_markup=InlineKeyboardMarkup(keyboard),
-                parse_mode=ParseMode.HTML
-            )
-            
-    elif data.startswith("clips_"):
-        if user_id not in user_states:
-            await query.edit_message_text("❌ Session expired. Please send the video link again.")
-            return
-        
-        num_clips = int(data.split("_")[1])
-        user_states[user_id]['num_clips'] = num_clips
-        
-        await query.edit_message_text(
-            f"💥⚡💥 <b>Processing your request...</b>\n\n"
-            f"Please wait while I work on your video!",
-            parse_mode=ParseMode.HTML
-        )
-        if query.message:
-            processing_messages[user_id] = query.message.message_id
-        
-        await process_video(query, context, user_id)
+    prefix, _, value = query.data.partition("_")
+    entry = CALLBACK_HANDLERS.get(prefix)
+    if not entry:
+        return
+    
+    handler, needs_session = entry
+    if needs_session and (user_id not in user_states or not user_states[user_id].url):
+        await edit_menu(query, context, "❌ Session expired. Please send the video link again.")
+        return
+    
+    await handler(query, context, user_id, value)
 
 
-async def process_video(query, context, user_id: int):
+async def process_video(query, context, user_id: int, state: UserState, message: tuple):
+    status = StatusMessage(context.bot, *message)
+    # per-job directories keep concurrent jobs from the same user apart and clean up with one rmtree
+    download_dir = Path(tempfile.mkdtemp(prefix=f"{user_id}_", dir=DOWNLOAD_DIR))
+    clips_dir = Path(tempfile.mkdtemp(prefix=f"{user_id}_", dir=CLIPS_DIR))
     try:
-        state = user_states.get(user_id)
-        if not state:
-            return
-        
-        url = state['url']
-        clip_duration = state['clip_duration']
-        num_clips = state['num_clips']
-        custom_range = state.get('custom_range')
+        url = state.url
+        clip_duration = state.clip_duration
+        num_clips = state.num_clips
+        custom_range = state.custom_range
         
         total_duration = clip_duration * num_clips if not custom_range else clip_duration
         
         if total_duration > MAX_CLIP_SECONDS:
-            await context.bot.edit_message_text(
-                chat_id=query.message.chat_id,
-                message_id=processing_messages[user_id],
-                text=f"⚙️ <b>This may take a while...</b>\n\n"
-                     f"Processing {num_clips} clip{'s' if num_clips > 1 else ''} ({total_duration}s total)\n"
-                     f"Please be patient! 💥⚡💥",
-                parse_mode=ParseMode.HTML
+            await status.update(
+                f"⚙️ <b>This may take a while...</b>\n\n"
+                f"Processing {num_clips} clip{'s' if num_clips > 1 else ''} ({total_duration}s total)\n"
+                f"Please be patient! 💥⚡💥"
             )
         
-        await context.bot.edit_message_text(
-            chat_id=query.message.chat_id,
-            message_id=processing_messages[user_id],
-            text=f"📥 <b>Downloading video...</b> 💥⚡💥",
-            parse_mode=ParseMode.HTML
+        await status.update(
+            f"📥 <b>Downloading video...</b> 💥⚡💥"
         )
         
-        download_result = await download_video(url, user_id)
-        if not download_result:
-            await context.bot.edit_message_text(
-                chat_id=query.message.chat_id,
-                message_id=processing_messages[user_id],
-                text="❌ <b>Download failed!</b>\n\nPlease check your link and try again.",
-                parse_mode=ParseMode.HTML
+        info = await get_video_info(url)
+        if not info:
+            await status.update(
+                "❌ <b>Download failed!</b>\n\nPlease check your link and try again.",
+                final=True
             )
             return
         
-        video_path, video_duration, video_title = download_result
-        bot_stats['videos_processed'] += 1
+        video_duration = info.get('duration') or 0
+        video_title = info.get('title') or 'video'
         
         if custom_range:
             start, end = custom_range
             if end > video_duration:
-                await context.bot.edit_message_text(
-                    chat_id=query.message.chat_id,
-                    message_id=processing_messages[user_id],
-                    text=f"❌ <b>Invalid range!</b>\n\n"
-                         f"Video duration is only {format_timestamp(video_duration)}.\n"
-                         f"Your requested end time ({format_timestamp(end)}) exceeds the video length.",
-                    parse_mode=ParseMode.HTML
+                await status.update(
+                    f"❌ <b>Invalid range!</b>\n\n"
+                    f"Video duration is only {format_timestamp(video_duration)}.\n"
+                    f"Your requested end time ({format_timestamp(end)}) exceeds the video length.",
+                    final=True
                 )
-                video_path.unlink(missing_ok=True)
                 return
         elif clip_duration > video_duration:
-            await context.bot.edit_message_text(
-                chat_id=query.message.chat_id,
-                message_id=processing_messages[user_id],
-                text=f"❌ <b>Clip too long!</b>\n\n"
-                     f"Video duration is only {format_timestamp(video_duration)}.\n"
-                     f"Your requested clip length ({clip_duration}s) is longer than the video.",
-                parse_mode=ParseMode.HTML
+            await status.update(
+                f"❌ <b>Clip too long!</b>\n\n"
+                f"Video duration is only {format_timestamp(video_duration)}.\n"
+                f"Your requested clip length ({clip_duration}s) is longer than the video.",
+                final=True
             )
-            video_path.unlink(missing_ok=True)
             return
         
-        await context.bot.edit_message_text(
-            chat_id=query.message.chat_id,
-            message_id=processing_messages[user_id],
-            text=f"✂️ <b>Creating clips...</b> 💥⚡💥\n\n"
-                 f"Video: {video_title[:40]}...",
-            parse_mode=ParseMode.HTML
-        )
+        # a single custom range only needs that stretch, unless the whole source is already cached;
+        # yt-dlp cuts it with the same keyframe-seek stream copy copy_clip would, so it is the clip
+        video_path = None
+        section_path = None
+        key = source_cache_key(info)
+        cached = bool(key and await asyncio.to_thread(find_cached_source, key))
+        if custom_range and not cached:
+            section_path = await download_section(info, download_dir, *custom_range)
+        if not section_path:
+            if not cached and not fits_work_dir(info):
+                await status.update(
+                    "❌ <b>Video too large!</b>\n\n"
+                    "This video is too big to process right now. Try a shorter video or a custom range.",
+                    final=True
+                )
+                return
+            video_path = await download_video(info, download_dir)
+        if not section_path and not video_path:
+            await status.update(
+                "❌ <b>Download failed!</b>\n\nPlease check your link and try again.",
+                final=True
+            )
+            return
+        
+        bot_stats['videos_processed'] += 1
         
-        clips_created = []
+        ranges = []
         
         if custom_range:
             start, end = custom_range
             start = max(0, min(start, video_duration - 1))
             end = max(start + 1, min(end, video_duration))
-            output_file = CLIPS_DIR / f"{user_id}_clip_1.mp4"
-            success = await create_clip(video_path, start, end, output_file)
-            if success:
-                clips_created.append(output_file)
-                bot_stats['clips_created'] += 1
+            ranges.append((start, end))
         else:
             interval = max(1, int((video_duration - clip_duration) / max(num_clips - 1, 1)))
             
             for i in range(num_clips):
                 start = max(0, min(i * interval, video_duration - clip_duration))
                 end = min(start + clip_duration, video_duration)
-                
-                output_file = CLIPS_DIR / f"{user_id}_clip_{i+1}.mp4"
-                success = await create_clip(video_path, start, end, output_file)
-                if success:
-                    clips_created.append(output_file)
-                    bot_stats['clips_created'] += 1
+                ranges.append((start, end))
+        
+        clip_sem = asyncio.Semaphore(CLIP_CONCURRENCY)
+        clips_done = 0
+        
+        def clips_progress_text() -> str:
+            return (
+                f"✂️ <b>Creating clips... {clips_done}/{len(ranges)}</b> 💥⚡💥\n\n"
+                f"Video: {html.escape(video_title[:40])}..."
+            )
+        
+        await status.update(clips_progress_text())
+        
+        output_files = [clips_dir / f"clip_{i}.mp4" for i in range(1, len(ranges) + 1)]
+        if section_path:
+            output_files[0] = section_path.rename(clips_dir / f"clip_1{section_path.suffix}")
+        elif len(ranges) > 1:
+            await copy_clips(video_path, ranges, output_files)
+        
+        async def make_clip(start: int, end: int, output_file: Path) -> Optional[Path]:
+            nonlocal clips_done
+            success = output_file.exists() and output_file.stat().st_size > 0
+            if not success:
+                async with clip_sem:
+                    success = await create_clip(video_path, start, end, output_file)
+            clips_done += 1
+            await status.update(clips_progress_text())
+            if not success:
+                output_file.unlink(missing_ok=True)
+                return None
+            return output_file
+        
+        results = await asyncio.gather(*[make_clip(start, end, output_file) for (start, end), output_file in zip(ranges, output_files)])
+        clips_created = [clip_file for clip_file in results if clip_file]
+        bot_stats['clips_created'] += len(clips_created)
         
         if not clips_created:
-            await context.bot.edit_message_text(
-                chat_id=query.message.chat_id,
-                message_id=processing_messages[user_id],
-                text="❌ <b>Clip creation failed!</b>\n\nPlease try again later.",
-                parse_mode=ParseMode.HTML
+            await status.update(
+                "❌ <b>Clip creation failed!</b>\n\nPlease try again later.",
+                final=True
             )
-            video_path.unlink(missing_ok=True)
             return
         
-        await context.bot.edit_message_text(
-            chat_id=query.message.chat_id,
-            message_id=processing_messages[user_id],
-            text=f"☁️ <b>Uploading to GoFile...</b> 💥⚡💥",
-            parse_mode=ParseMode.HTML
+        await status.update(
+            f"☁️ <b>Uploading to GoFile...</b> 💥⚡💥"
         )
         
-        upload_links = []
-        for clip_file in clips_created:
-            link = await upload_to_gofile(clip_file)
-            if link:
-                upload_links.append(link)
-            clip_file.unlink(missing_ok=True)
-        
-        video_path.unlink(missing_ok=True)
+        links = await asyncio.gather(*[upload_to_gofile(clip_file) for clip_file in clips_created])
+        upload_links = [link for link in links if link]
         
         if upload_links:
             result_text = f"✅ <b>All Done!</b>\n\n"
@@ -625,71 +1242,72 @@ async def process_video(query, context, user_id: int):
             for idx, link in enumerate(upload_links, 1):
                 result_text += f"{idx}. <a href='{link}'>Download Clip {idx}</a>\n"
             
-            keyboard = [[InlineKeyboardButton("🔄 Create Another", callback_data="help")]]
-            
-            await context.bot.edit_message_text(
-                chat_id=query.message.chat_id,
-                message_id=processing_messages[user_id],
-                text=result_text,
-                reply_markup=InlineKeyboardMarkup(keyboard),
-                parse_mode=ParseMode.HTML,
+            await status.update(
+                result_text,
+                final=True,
+                reply_markup=CREATE_ANOTHER_MARKUP,
                 disable_web_page_preview=True
             )
         else:
-            await context.bot.edit_message_text(
-                chat_id=query.message.chat_id,
-                message_id=processing_messages[user_id],
-                text="❌ <b>Upload failed!</b>\n\nClips were created but upload failed. Please try again.",
-                parse_mode=ParseMode.HTML
+            await status.update(
+                "❌ <b>Upload failed!</b>\n\nClips were created but upload failed. Please try again.",
+                final=True
             )
         
-        if user_id in user_states:
+        # the user may have pasted a new link while this ran; only clear the session if it is still this job's
+        if user_states.get(user_id) is state:
             del user_states[user_id]
-        if user_id in processing_messages:
-            del processing_messages[user_id]
             
     except Exception as e:
         logger.error(f"Processing error for user {user_id}: {e}")
         try:
-            await context.bot.edit_message_text(
-                chat_id=query.message.chat_id,
-                message_id=processing_messages.get(user_id),
-                text=f"❌ <b>An error occurred!</b>\n\n{str(e)[:100]}",
-                parse_mode=ParseMode.HTML
+            await status.update(
+                f"❌ <b>An error occurred!</b>\n\n{str(e)[:100]}",
+                final=True
             )
         except:
             pass
+    finally:
+        # always drop the source video and clips, even when a step above raised
+        shutil.rmtree(clips_dir, ignore_errors=True)
+        shutil.rmtree(download_dir, ignore_errors=True)
 
 
-def main():
-    if not BOT_TOKEN:
-        logger.error("BOT_TOKEN not found in environment variables!")
-        return
-    
-    application = Application.builder().token(BOT_TOKEN).build()
-    
-    application.add_handler(CommandHandler("start", start_command))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("feedback", feedback_command))
-    application.add_handler(CommandHandler("donate", donate_command))
-    application.add_handler(CommandHandler("stats", stats_command))
-    application.add_handler(CallbackQueryHandler(button_callback))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-    
-    logger.info("🚀 Clipper Bot started!")
-    # --- fix: start Render health server safely inside the event loop ---
-    loop = asyncio.get_event_loop()
-    loop.create_task(start_health_server())
-    # -------------------------------------------------------------------
-    
-    # ===================== WEBHOOK MODE (Render Deployment) =====================
+def webhook_port() -> int:
+    return int(os.environ.get("PORT", HTTP_PORT))
+
+
+async def on_startup(application: Application):
+    get_http_session()
+    # runs inside the application's loop, before the webhook starts; sharing the webhook's port would clash
+    if HTTP_PORT != webhook_port():
+        await start_health_server(HTTP_PORT)
+
+
+async def on_shutdown(application: Application):
+    await close_http_session()
+    await stop_health_server()
 
-async def main():
+
+def main():
     if not BOT_TOKEN:
         logger.error("BOT_TOKEN not found in environment variables!")
         return
 
-    app = Application.builder().token(BOT_TOKEN).build()
+    # AIORateLimiter keeps outgoing calls under Telegram's global and per-chat limits and retries 429s
+    app = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .rate_limiter(AIORateLimiter(max_retries=3))
+        # multiplex the many edit/delete calls over one HTTP/2 connection instead of queueing for a pool slot
+        .http_version("2")
+        .connection_pool_size(256)
+        .read_timeout(20)
+        .write_timeout(20)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
     # Register your handlers
     app.add_handler(CommandHandler("start", start_command))
@@ -698,16 +1316,15 @@ async def main():
     app.add_handler(CommandHandler("donate", donate_command))
     app.add_handler(CommandHandler("stats", stats_command))
     app.add_handler(CallbackQueryHandler(button_callback))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-
-    # Start the health check server in background (important for Render)
-    asyncio.create_task(start_health_server())
+    # only private chats: in groups every stray message would cost a reply and a delete
+    app.add_handler(MessageHandler(filters.ChatType.PRIVATE & filters.TEXT & ~filters.COMMAND, handle_message))
 
-    # Remove any previous webhook to avoid conflicts
-    await app.bot.delete_webhook(drop_pending_updates=True)
+    # sweep leftovers from crashed jobs now and every 10 minutes, off the event loop
+    app.job_queue.run_repeating(cleanup_job, interval=600, first=0)
+    app.job_queue.run_repeating(expire_sessions_job, interval=60, first=60)
 
     # Use Render-provided PORT and your app’s public HTTPS URL
-    port = int(os.environ.get("PORT", os.environ.get("HTTP_PORT", 8080)))
+    port = webhook_port()
     public_url = os.environ.get("PUBLIC_URL")  # e.g. https://your-app-name.onrender.com
     if not public_url:
         logger.error("PUBLIC_URL is missing. Set PUBLIC_URL in Render env vars.")
@@ -724,11 +1341,13 @@ async def main():
         port=port,
         url_path=webhook_path,
         webhook_url=webhook_url,
+        # replaces any previous webhook and skips updates queued while the bot was down
+        drop_pending_updates=True,
     )
 
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        main()
     except KeyboardInterrupt:
         logger.info("Bot stopped.")